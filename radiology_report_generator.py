@@ -8,12 +8,18 @@ import json
 import os
 import time
 import shutil
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 from dataclasses import dataclass
 import google.generativeai as genai
 import re
 import asyncio
+import random
+import threading
 import pdfquery
+from string import Template
+import hashlib
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 
 # Google Drive API imports
 from google.oauth2.credentials import Credentials
@@ -21,16 +27,89 @@ from google.oauth2 import service_account
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
 from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseDownload
+from googleapiclient.http import MediaIoBaseDownload, HttpRequest, build_http
+from google_auth_httplib2 import AuthorizedHttp
 import io
 import pickle
+import logging
+import sys
 
+try:
+    import orjson  # Faster parsing for splitter JSON; falls back to json when not installed
+except ImportError:
+    orjson = None
 
+try:
+    import uvloop  # Faster event loop for the Gemini fan-out; the asyncio default loop is used when not installed
+except ImportError:
+    uvloop = None
+
+
+
+
+def loads_json(text):
+    """Parse a JSON response, using orjson when it is available"""
+    if orjson is not None:
+        return orjson.loads(text.encode() if isinstance(text, str) else text)
+    return json.loads(text)
 
 
 # Google Drive API scopes
 SCOPES = ['https://www.googleapis.com/auth/drive.readonly']
 TEMP_DOWNLOAD_DIR = "./temp_pdfs"  # Temporary directory for downloaded PDFs
+DRIVE_DOWNLOAD_WORKERS = int(os.environ.get("DRIVE_DOWNLOAD_WORKERS", "8"))  # PDFs downloaded in parallel
+PDF_PARSE_WORKERS = int(os.environ.get("PDF_PARSE_WORKERS") or os.cpu_count() or 1)  # PDF parser processes
+PDF_PARSE_CHUNKSIZE = 8  # PDFs handed to a worker per round trip
+DRIVE_BATCH_LIMIT = 100  # Most calls Drive accepts in one batch request
+DRIVE_PAGE_SIZE = 1000  # Largest page files().list returns
+MAX_CONCURRENT_PATIENTS = int(os.environ.get("MAX_CONCURRENT_PATIENTS", "8"))  # Patients in flight per batch
+SPLITTER_BATCH_SIZE = int(os.environ.get("SPLITTER_BATCH_SIZE", "5"))  # Patients per splitter request
+GEMINI_RPM = int(os.environ.get("GEMINI_RPM", "1000"))  # Requests per minute sent to Gemini (0 = unlimited)
+GEMINI_MAX_IN_FLIGHT = int(os.environ.get("GEMINI_MAX_IN_FLIGHT", "32"))  # Concurrent Gemini requests (0 = unlimited)
+MAX_RETRY_DELAY = 30  # Cap in seconds on the exponential backoff before jitter
+MAX_RETRY_HINT = 60  # Cap in seconds on a server-suggested retry delay
+EAGER_TASKS = os.environ.get("EAGER_TASKS", "0") == "1"  # Opt-in eager task start (Python 3.12+)
+
+# Per-patient progress messages; set VERBOSE=0 to silence them during large batches
+VERBOSE = os.environ.get("VERBOSE", "1") != "0"
+logger = logging.getLogger("radreport")
+_log_handler = logging.StreamHandler(sys.stdout)
+_log_handler.setFormatter(logging.Formatter("%(message)s"))
+logger.addHandler(_log_handler)
+logger.setLevel(logging.INFO if VERBOSE else logging.WARNING)
+logger.propagate = False
+
+
+def render_report(ultrasound_type: str, findings: str, impression: str) -> str:
+    """Render the final report text"""
+    return f"""ULTRASOUND {ultrasound_type.upper()}
+
+{findings}
+
+IMPRESSION:
+{impression}
+"""
+
+
+# Banner line - built once instead of per patient in the batch loop
+BANNER = "=" * 80
+
+
+def format_patient_header(name: str) -> str:
+    """Format the header that precedes each patient's report in a batch file"""
+    return f"{BANNER}\nPATIENT {name}\n{BANNER}"
+
+
+# Section texts that mean "no pathology" (compared lowercased)
+NO_PATHOLOGY_KEYWORDS = frozenset({'np', 'normal', 'unremarkable'})
+
+
+def is_no_pathology(section: str) -> bool:
+    """Determine if a split section only states that there is no pathology"""
+    if not section:
+        return False
+    # Ignore surrounding whitespace, bullets and full stops ("- NP", "Normal.")
+    return section.strip(' \t\r\n-*•.').lower() in NO_PATHOLOGY_KEYWORDS
 
 
 def authenticate_gdrive():
@@ -82,7 +161,7 @@ def authenticate_gdrive():
                         credentials_path, SCOPES)
                     creds = flow.run_local_server(port=0)
                     # Save credentials for future use
-                    token_save_path = find_file('token.pickle') or 'token.pickle'
+                    token_save_path = token_path or 'token.pickle'
                     with open(token_save_path, 'wb') as token:
                         pickle.dump(creds, token)
                 else:
@@ -93,11 +172,27 @@ def authenticate_gdrive():
                         "Place credentials in ./credentials/ directory or current directory"
                     )
     
-    return build('drive', 'v3', credentials=creds)
+    # httplib2 is not thread-safe: each thread gets its own connection, kept alive
+    # across its requests so worker threads don't redo the TLS handshake per download
+    # (build_http keeps the client library's default socket timeout and redirect codes)
+    local = threading.local()
+    
+    def build_request(http, *args, **kwargs):
+        if not hasattr(local, 'http'):
+            local.http = AuthorizedHttp(creds, http=build_http())
+        return HttpRequest(local.http, *args, **kwargs)
+    
+    return build('drive', 'v3', credentials=creds, requestBuilder=build_request)
+
+
+def escape_drive_query(value):
+    """Escape a string for use inside a quoted Drive query literal"""
+    return value.replace('\\', '\\\\').replace("'", "\\'")
+
 
 def find_folder_by_name(service, folder_name, parent_id=None):
     """Find a folder in Google Drive by name"""
-    query = f"name='{folder_name}' and mimeType='application/vnd.google-apps.folder' and trashed=false"
+    query = f"name='{escape_drive_query(folder_name)}' and mimeType='application/vnd.google-apps.folder' and trashed=false"
     if parent_id:
         query += f" and '{parent_id}' in parents"
     
@@ -111,32 +206,75 @@ def find_folder_by_name(service, folder_name, parent_id=None):
     return items[0]['id'] if items else None
 
 
+def files_list_request(service, query, page_token=None):
+    """Build (without executing) one page of a files().list query"""
+    return service.files().list(
+        q=query,
+        spaces='drive',
+        fields='nextPageToken, files(id, name)',
+        orderBy='name',
+        pageSize=DRIVE_PAGE_SIZE,
+        pageToken=page_token
+    )
+
+
+def list_all_files(service, query, page_token=None):
+    """Run a files().list query, following nextPageToken until every page is read"""
+    files = []
+    while True:
+        results = files_list_request(service, query, page_token).execute()
+        files.extend(results.get('files', []))
+        page_token = results.get('nextPageToken')
+        if not page_token:
+            return files
+
+
 def list_folders(service, parent_id):
     """List all folders in a parent folder"""
     query = f"'{parent_id}' in parents and mimeType='application/vnd.google-apps.folder' and trashed=false"
-    
-    results = service.files().list(
-        q=query,
-        spaces='drive',
-        fields='files(id, name)',
-        orderBy='name'
-    ).execute()
-    
-    return results.get('files', [])
+    return list_all_files(service, query)
+
+
+def pdf_files_query(folder_id):
+    """Query matching all PDF files in a folder"""
+    return f"'{folder_id}' in parents and mimeType='application/pdf' and trashed=false"
 
 
 def list_pdf_files(service, folder_id):
     """List all PDF files in a folder"""
-    query = f"'{folder_id}' in parents and mimeType='application/pdf' and trashed=false"
+    return list_all_files(service, pdf_files_query(folder_id))
+
+
+def list_pdf_files_batch(service, folder_ids):
+    """
+    List the PDF files of several folders using Drive batch requests (one HTTP
+    round trip per DRIVE_BATCH_LIMIT folders). Returns {folder_id: files}.
+    """
+    pdf_files = {}
+    next_pages = {}
     
-    results = service.files().list(
-        q=query,
-        spaces='drive',
-        fields='files(id, name)',
-        orderBy='name'
-    ).execute()
+    def collect(request_id, response, exception):
+        if exception is None:
+            pdf_files[request_id] = response.get('files', [])
+            if response.get('nextPageToken'):
+                next_pages[request_id] = response['nextPageToken']
+    
+    for start in range(0, len(folder_ids), DRIVE_BATCH_LIMIT):
+        batch = service.new_batch_http_request(callback=collect)
+        for folder_id in folder_ids[start:start + DRIVE_BATCH_LIMIT]:
+            batch.add(files_list_request(service, pdf_files_query(folder_id)), request_id=folder_id)
+        batch.execute()
+    
+    # Folders with more than one page of PDFs fetch the remaining pages directly
+    for folder_id, page_token in next_pages.items():
+        pdf_files[folder_id].extend(list_all_files(service, pdf_files_query(folder_id), page_token))
+    
+    # Folders whose batched call failed are listed one at a time
+    for folder_id in folder_ids:
+        if folder_id not in pdf_files:
+            pdf_files[folder_id] = list_pdf_files(service, folder_id)
     
-    return results.get('files', [])
+    return pdf_files
 
 
 def download_file(service, file_id, destination_path):
@@ -159,9 +297,9 @@ def download_pdfs_from_gdrive(service, base_folder_name="patient_data"):
     
     Returns the local path to the downloaded files
     """
-    print(f"\n{'='*80}")
+    print(f"\n{BANNER}")
     print(f"CONNECTING TO GOOGLE DRIVE")
-    print(f"{'='*80}")
+    print(f"{BANNER}")
     
     # Find the patient_data folder
     print(f"\nSearching for folder: {base_folder_name}")
@@ -188,9 +326,9 @@ def download_pdfs_from_gdrive(service, base_folder_name="patient_data"):
     
     print(f"\nFound {len(date_folders)} date folder(s)")
     
-    total_files = 0
-    
-    # For each date folder
+    # List every date folder first (batched), then download all PDFs in parallel
+    pdf_files_by_folder = list_pdf_files_batch(service, [folder['id'] for folder in date_folders])
+    downloads = []
     for date_folder in date_folders:
         date_name = date_folder['name']
         date_id = date_folder['id']
@@ -201,8 +339,7 @@ def download_pdfs_from_gdrive(service, base_folder_name="patient_data"):
         local_date_folder = os.path.join(TEMP_DOWNLOAD_DIR, date_name)
         os.makedirs(local_date_folder, exist_ok=True)
         
-        # List PDF files in this date folder
-        pdf_files = list_pdf_files(service, date_id)
+        pdf_files = pdf_files_by_folder[date_id]
         
         if not pdf_files:
             print(f"    ⚠ No PDF files found in {date_name}")
@@ -210,24 +347,37 @@ def download_pdfs_from_gdrive(service, base_folder_name="patient_data"):
         
         print(f"    Found {len(pdf_files)} PDF file(s)")
         
-        # Download each PDF
-        for idx, pdf_file in enumerate(pdf_files, 1):
-            file_name = pdf_file['name']
-            file_id = pdf_file['id']
-            
-            destination = os.path.join(local_date_folder, file_name)
-            
+        # Drive allows repeated names in a folder - only the first is downloaded, so two
+        # workers never write the same local file
+        seen_names = set()
+        for pdf_file in pdf_files:
+            if pdf_file['name'] in seen_names:
+                print(f"    ⚠ Skipping duplicate file name {date_name}/{pdf_file['name']} (id {pdf_file['id']})")
+                continue
+            seen_names.add(pdf_file['name'])
+            destination = os.path.join(local_date_folder, pdf_file['name'])
+            downloads.append((date_name, pdf_file['name'], pdf_file['id'], destination))
+    
+    print(f"\nDownloading {len(downloads)} PDF file(s), {DRIVE_DOWNLOAD_WORKERS} at a time...")
+    total_files = 0
+    with ThreadPoolExecutor(max_workers=DRIVE_DOWNLOAD_WORKERS) as executor:
+        futures = {
+            executor.submit(download_file, service, file_id, destination): (date_name, file_name)
+            for date_name, file_name, file_id, destination in downloads
+        }
+        for done, future in enumerate(as_completed(futures), 1):
+            date_name, file_name = futures[future]
             try:
-                download_file(service, file_id, destination)
-                print(f"    ✓ [{idx}/{len(pdf_files)}] {file_name}")
+                future.result()
+                logger.info("    ✓ [%d/%d] %s/%s", done, len(downloads), date_name, file_name)
                 total_files += 1
             except Exception as e:
-                print(f"    ✗ Error downloading {file_name}: {e}")
+                print(f"    ✗ Error downloading {date_name}/{file_name}: {e}")
     
-    print(f"\n{'='*80}")
+    print(f"\n{BANNER}")
     print(f"✓ DOWNLOAD COMPLETE")
     print(f"✓ Total files downloaded: {total_files}")
-    print(f"{'='*80}\n")
+    print(f"{BANNER}\n")
     
     return TEMP_DOWNLOAD_DIR
 
@@ -235,92 +385,128 @@ def download_pdfs_from_gdrive(service, base_folder_name="patient_data"):
 def cleanup_downloaded_files():
     """Delete the temporary downloaded PDF files"""
     if os.path.exists(TEMP_DOWNLOAD_DIR):
-        print(f"\n{'='*80}")
+        print(f"\n{BANNER}")
         print(f"CLEANING UP DOWNLOADED FILES")
-        print(f"{'='*80}")
+        print(f"{BANNER}")
         
-        # Count files before deletion
+        # Delete files bottom-up, counting them in the same pass
         file_count = 0
-        for root, dirs, files in os.walk(TEMP_DOWNLOAD_DIR):
+        for root, dirs, files in os.walk(TEMP_DOWNLOAD_DIR, topdown=False):
+            for file_name in files:
+                os.remove(os.path.join(root, file_name))
             file_count += len(files)
-        
-        # Delete directory
-        shutil.rmtree(TEMP_DOWNLOAD_DIR)
+            os.rmdir(root)
         
         print(f"✓ Deleted {file_count} temporary file(s)")
         print(f"✓ Removed directory: {TEMP_DOWNLOAD_DIR}")
-        print(f"{'='*80}\n")
+        print(f"{BANNER}\n")
+
+
+# Filename number pattern - compiled once and reused for every PDF in a folder
+NUMBER_PATTERN = re.compile(r'\d+')
 
 
 def extract_number(filename):
     """Extract number from filename for sorting"""
-    match = re.search(r'\d+', filename)
+    match = NUMBER_PATTERN.search(filename)
     return int(match.group()) if match else 0
 
 
+# Common ultrasound types, checked in order - the first one named in the text wins
+ULTRASOUND_TYPES = {
+    'abdomen': 'Abdomen',
+    'liver': 'Liver',
+    'kidney': 'Kidney',
+    'pelvis': 'Pelvis',
+    'thyroid': 'Thyroid',
+    'breast': 'Breast',
+    'obstetric': 'Obstetric',
+    'cardiac': 'Cardiac',
+    'vascular': 'Vascular',
+}
+
+
 def extract_ultrasound_type(text):
     """Extract ultrasound type from text"""
     if not text:
         return "Abdomen"
     
-    # Common ultrasound types
-    types_map = {
-        'abdomen': 'Abdomen',
-        'liver': 'Liver',
-        'kidney': 'Kidney',
-        'pelvis': 'Pelvis',
-        'thyroid': 'Thyroid',
-        'breast': 'Breast',
-        'obstetric': 'Obstetric',
-        'cardiac': 'Cardiac',
-        'vascular': 'Vascular',
-    }
-    
     text_lower = text.lower()
-    for key, value in types_map.items():
+    for key, value in ULTRASOUND_TYPES.items():
         if key in text_lower:
             return value
     
-    return text.strip() if text.strip() else "Abdomen"
+    return text.strip() or "Abdomen"
 
 
-def read_pdfs_in_folder(folder_path):
-    """Read patient information from PDF files in a single folder"""
+def _parse_one_pdf(file_path: str) -> Tuple[Optional[Dict], Optional[str]]:
+    """
+    Extract name, findings and ultrasound type from one PDF.
+    Runs in a worker process, so errors are returned instead of raised.
+    """
+    try:
+        pdf = pdfquery.PDFQuery(file_path)
+        pdf.load()
+        name = pdf.pq('LTTextLineHorizontal:overlaps_bbox("157.096, 670.611, 221.032, 679.611")').text()
+        examination_finding = pdf.pq('LTTextBoxHorizontal:overlaps_bbox("153.846, 153.361, 394.291, 442.861")').text()
+        ultrasound_type = extract_ultrasound_type(
+            pdf.pq('LTTextLineHorizontal:overlaps_bbox("157.846, 580.611, 218.821, 589.611")').text()
+        )
+    except Exception as e:
+        return None, str(e)
+    
+    return {
+        'examination_finding': examination_finding,
+        'ultrasound_type': ultrasound_type,
+        'name': name
+    }, None
+
+
+def list_pdfs_in_folder(folder_path):
+    """List PDF file names in a folder, sorted by file number"""
+    with os.scandir(folder_path) as entries:
+        pdf_files = [entry.name for entry in entries if entry.name.endswith(".pdf") and entry.is_file()]
+    pdf_files.sort(key=extract_number)
+    return pdf_files
+
+
+def read_pdfs_in_folder(folder_path, parsed=None):
+    """
+    Read patient information from PDF files in a single folder.
+    `parsed` holds _parse_one_pdf results already computed by a worker pool, keyed by path.
+    """
     findings = {}
     if not os.path.exists(folder_path):
         print(f"Folder '{folder_path}' not found.")
         return findings
      
-    for file_name in sorted(os.listdir(folder_path), key=extract_number):
-        if file_name.endswith(".pdf"):
-            file_path = os.path.join(folder_path, file_name)
-            try:
-                pdf = pdfquery.PDFQuery(file_path)
-                pdf.load()
-                name = pdf.pq('LTTextLineHorizontal:overlaps_bbox("157.096, 670.611, 221.032, 679.611")').text()
-                examination_finding = pdf.pq('LTTextBoxHorizontal:overlaps_bbox("153.846, 153.361, 394.291, 442.861")').text()
-                ultrasound_type = extract_ultrasound_type(
-                    pdf.pq('LTTextLineHorizontal:overlaps_bbox("157.846, 580.611, 218.821, 589.611")').text()
-                )
-                 
-                # Merge findings and ultrasound types
-                if name in findings:
-                    findings[name].append({
-                        'examination_finding': examination_finding,
-                        'ultrasound_type': ultrasound_type,
-                        'name': name
-                    })
-                else:
-                    findings[name] = [{
-                        'examination_finding': examination_finding,
-                        'ultrasound_type': ultrasound_type,
-                        'name': name
-                    }]
-            except Exception as e:
-                print(f"Error reading {file_name}: {e}")
+    for file_name in list_pdfs_in_folder(folder_path):
+        file_path = os.path.join(folder_path, file_name)
+        if parsed is not None and file_path in parsed:
+            entry, error = parsed[file_path]
+        else:
+            entry, error = _parse_one_pdf(file_path)
+        
+        if error is not None:
+            print(f"Error reading {file_name}: {error}")
+            continue
+         
+        # Merge findings and ultrasound types
+        findings.setdefault(entry['name'], []).append(entry)
     return findings
 
 
+def parse_pdfs(file_paths):
+    """Parse PDFs across a process pool (pdfminer layout analysis is CPU-bound)"""
+    if PDF_PARSE_WORKERS <= 1 or len(file_paths) <= 1:
+        return {path: _parse_one_pdf(path) for path in file_paths}
+    
+    workers = min(PDF_PARSE_WORKERS, len(file_paths))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(_parse_one_pdf, file_paths, chunksize=PDF_PARSE_CHUNKSIZE)
+        return dict(zip(file_paths, results))
+
+
 def process_date_folders(base_folder_path):
     """
     Process all date folders in the base folder.
@@ -333,23 +519,27 @@ def process_date_folders(base_folder_path):
         return date_findings
     
     # Get all subdirectories (date folders)
-    subdirs = []
-    for item in os.listdir(base_folder_path):
-        item_path = os.path.join(base_folder_path, item)
-        if os.path.isdir(item_path):
-            subdirs.append(item)
+    with os.scandir(base_folder_path) as entries:
+        subdirs = [entry.name for entry in entries if entry.is_dir()]
     
     # Sort date folders
     subdirs.sort()
     
     print(f"\nFound {len(subdirs)} date folder(s): {', '.join(subdirs)}")
     
+    # Parse every PDF across all date folders up front, in parallel
+    file_paths = []
+    for date_folder in subdirs:
+        date_folder_path = os.path.join(base_folder_path, date_folder)
+        file_paths.extend(os.path.join(date_folder_path, f) for f in list_pdfs_in_folder(date_folder_path))
+    parsed = parse_pdfs(file_paths)
+    
     for date_folder in subdirs:
         date_folder_path = os.path.join(base_folder_path, date_folder)
         print(f"\nProcessing date folder: {date_folder}")
         
         # Read PDFs from this date folder
-        findings = read_pdfs_in_folder(date_folder_path)
+        findings = read_pdfs_in_folder(date_folder_path, parsed)
         
         if findings:
             date_findings[date_folder] = findings
@@ -361,7 +551,7 @@ def process_date_folders(base_folder_path):
     return date_findings
 
 
-@dataclass
+@dataclass(slots=True)
 class PatientInfo:
     """Stores structured patient information by body part"""
     liver: str = ""
@@ -378,30 +568,198 @@ class PatientInfo:
             self.others = []
 
 
+# LRU cache of successful agent responses, shared by all agents.
+# Calls run at temperature=0, so identical prompts (e.g. "NP" sections) give the same report.
+RESPONSE_CACHE_SIZE = 4096
+_response_cache: "OrderedDict[Tuple[str, str], str]" = OrderedDict()
+# Requests currently awaiting the API, so concurrent duplicates join the first one
+_pending_responses: "Dict[Tuple[str, str], asyncio.Future]" = {}
+
+
+def response_cache_key(agent_name: str, prompt: str) -> Tuple[str, str]:
+    """Build the response cache key from the agent name and a hash of its prompt"""
+    return agent_name, hashlib.sha1(prompt.strip().encode('utf-8')).hexdigest()
+
+
+def get_cached_response(key: Tuple[str, str]) -> Optional[str]:
+    """Return a cached response (marking it as recently used) or None"""
+    response = _response_cache.get(key)
+    if response is not None:
+        _response_cache.move_to_end(key)
+    return response
+
+
+def cache_response(key: Tuple[str, str], response: str):
+    """Store a response, evicting the least recently used entry when full"""
+    _response_cache[key] = response
+    _response_cache.move_to_end(key)
+    if len(_response_cache) > RESPONSE_CACHE_SIZE:
+        _response_cache.popitem(last=False)
+
+
+# Generation settings shared by every report call - built once, not per request
+REPORT_GENERATION_CONFIG = genai.GenerationConfig(
+    temperature=0,
+    max_output_tokens=5000,
+)
+
+# API key the genai module is configured with. configure() is global and resets
+# the SDK's shared clients, so it runs once per key rather than once per agent.
+_configured_api_key: Optional[str] = None
+
+
+def configure_genai(api_key: str):
+    """Configure the genai module for api_key unless it already is"""
+    global _configured_api_key
+    if api_key != _configured_api_key:
+        genai.configure(api_key=api_key)
+        _configured_api_key = api_key
+
+
+# GenerativeModel instances shared by all agents, keyed by system instruction ("" = none)
+MODEL_NAME = 'gemini-2.5-flash'
+_models: Dict[str, genai.GenerativeModel] = {}
+
+
+def get_model(system_instruction: str = "") -> genai.GenerativeModel:
+    """Shared model for a system instruction, built on first use"""
+    model = _models.get(system_instruction)
+    if model is None:
+        model = genai.GenerativeModel(MODEL_NAME, system_instruction=system_instruction or None)
+        _models[system_instruction] = model
+    return model
+
+
+def backoff_delay(initial_delay: float, attempt: int) -> float:
+    """Capped exponential backoff plus full jitter, so agents hit by the same 429 retry at different times"""
+    delay = min(MAX_RETRY_DELAY, initial_delay * (2 ** attempt))
+    return delay + random.uniform(0, delay)
+
+
+# Server retry hints in 429 errors: RetryInfo "retry_delay { seconds: N }" or "Please retry in Ns"
+RETRY_DELAY_PATTERN = re.compile(r'retry(?:_delay \{\s*seconds:| in)\s*(\d+(?:\.\d+)?)', re.IGNORECASE)
+
+
+def retry_delay_for(error: Exception, initial_delay: float, attempt: int) -> float:
+    """Delay before retrying a rate-limited call - the server's hint when it gives one, else backoff"""
+    match = RETRY_DELAY_PATTERN.search(str(error))
+    if match:
+        # Daily-quota hints can be hours long - never sleep longer than MAX_RETRY_HINT
+        return min(float(match.group(1)), MAX_RETRY_HINT) + random.uniform(0, 1)
+    return backoff_delay(initial_delay, attempt)
+
+
+class RequestRateLimiter:
+    """
+    Holds Gemini requests back before they would exceed the RPM quota (sliding
+    window) or the number allowed in flight. Use as `async with request_limiter:`.
+    """
+    
+    def __init__(self, requests_per_minute: int, max_in_flight: int, window: float = 60.0):
+        self.requests_per_minute = requests_per_minute
+        self.window = window
+        self._sent = deque()  # monotonic send times inside the current window
+        self._in_flight = asyncio.Semaphore(max_in_flight) if max_in_flight > 0 else None
+    
+    async def __aenter__(self):
+        if self._in_flight is not None:
+            await self._in_flight.acquire()
+        try:
+            await self.acquire()
+        except BaseException:
+            if self._in_flight is not None:
+                self._in_flight.release()
+            raise
+        return self
+    
+    async def __aexit__(self, exc_type, exc, tb):
+        if self._in_flight is not None:
+            self._in_flight.release()
+    
+    async def acquire(self):
+        """Wait until another request fits in the window, then record it"""
+        if self.requests_per_minute <= 0:
+            return
+        while True:
+            now = time.monotonic()
+            while self._sent and now - self._sent[0] >= self.window:
+                self._sent.popleft()
+            if len(self._sent) < self.requests_per_minute:
+                self._sent.append(now)
+                return
+            await asyncio.sleep(self._sent[0] + self.window - now)
+
+
+# Shared by every agent so the whole fan-out stays under one quota
+request_limiter = RequestRateLimiter(GEMINI_RPM, GEMINI_MAX_IN_FLIGHT)
+
+
+# Event loop behind the synchronous wrappers - started on first use, kept for the process
+_sync_loop: Optional[asyncio.AbstractEventLoop] = None
+_sync_loop_lock = threading.Lock()
+
+
+def run_sync(coro):
+    """Run a coroutine to completion from synchronous code on the shared background loop"""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        pass
+    else:
+        coro.close()
+        raise RuntimeError("Synchronous API called inside a running event loop - await the async method instead")
+    
+    global _sync_loop
+    with _sync_loop_lock:
+        if _sync_loop is None:
+            _sync_loop = uvloop.new_event_loop() if uvloop is not None else asyncio.new_event_loop()
+            # Opt-in: tasks run until their first real await, which changes scheduling order
+            # for the in-flight dedup and semaphores (needs Python 3.12+)
+            if EAGER_TASKS and hasattr(asyncio, "eager_task_factory"):
+                _sync_loop.set_task_factory(asyncio.eager_task_factory)
+            threading.Thread(target=_sync_loop.run_forever, daemon=True).start()
+    return asyncio.run_coroutine_threadsafe(coro, _sync_loop).result()
+
+
 class BaseAgent:
     """Base class for all agents"""
     
     def __init__(self, api_key: str):
-        genai.configure(api_key=api_key)
-        self.model = genai.GenerativeModel('gemini-2.5-flash')
+        configure_genai(api_key)
+        self.model = get_model()
         self.max_retries = 5
         self.initial_delay = 1
+        # Fixed report for a section that only says "NP" (None = always ask the model)
+        self.normal_report = None
     
     async def generate_response_async(self, prompt: str, system_prompt: str = "") -> str:
-        """Generate response using Gemini API"""
-        # Combine system prompt with user prompt
-        full_prompt = f"{system_prompt}\n\n{prompt}" if system_prompt else prompt
+        """Generate response using Gemini API (system_prompt is sent as the system instruction)"""
+        # Identical prompts for the same agent are answered from the cache
+        cache_key = response_cache_key(type(self).__name__, f"{system_prompt}\n\n{prompt}")
+        cached = get_cached_response(cache_key)
+        if cached is not None:
+            return cached
+        
+        # Identical requests already in flight (same finding in several patients) share one call
+        pending = _pending_responses.get(cache_key)
+        if pending is None:
+            pending = asyncio.ensure_future(self._request_response(prompt, system_prompt, cache_key))
+            _pending_responses[cache_key] = pending
+            pending.add_done_callback(lambda _: _pending_responses.pop(cache_key, None))
+        return await asyncio.shield(pending)
+    
+    async def _request_response(self, prompt: str, system_prompt: str, cache_key: Tuple[str, str]) -> str:
+        """Call the API with retries, caching a successful response"""
+        model = get_model(system_prompt)
         
         for attempt in range(self.max_retries):
             try:
-                response = await asyncio.to_thread(
-                    self.model.generate_content,
-                    full_prompt,
-                    generation_config=genai.GenerationConfig(
-                        temperature=0,
-                        max_output_tokens=5000,
+                async with request_limiter:
+                    response = await model.generate_content_async(
+                        prompt,
+                        generation_config=REPORT_GENERATION_CONFIG
                     )
-                )
+                cache_response(cache_key, response.text)
                 return response.text
             
             except Exception as e:
@@ -409,8 +767,8 @@ class BaseAgent:
 
                 if '429' in error_str or 'quota' in error_str or 'rate limit' in error_str or 'resource exhausted' in error_str:
                     if attempt < self.max_retries - 1:
-                        delay = self.initial_delay * (2 ** attempt)
-                        print(f"⚠️  Rate limit hit. Retrying in {delay} seconds... (attempt {attempt + 1}/{self.max_retries})")
+                        delay = retry_delay_for(e, self.initial_delay, attempt)
+                        print(f"⚠️  Rate limit hit. Retrying in {delay:.1f} seconds... (attempt {attempt + 1}/{self.max_retries})")
                         await asyncio.sleep(delay)
                         continue
                     else:
@@ -419,8 +777,8 @@ class BaseAgent:
                 
                 elif 'timeout' in error_str or 'connection' in error_str or 'unavailable' in error_str:
                     if attempt < self.max_retries - 1:
-                        delay = self.initial_delay * (2 ** attempt)
-                        print(f"⚠️  API error ({error_str[:50]}...). Retrying in {delay} seconds...")
+                        delay = backoff_delay(self.initial_delay, attempt)
+                        print(f"⚠️  API error ({error_str[:50]}...). Retrying in {delay:.1f} seconds...")
                         await asyncio.sleep(delay)
                         continue
                 
@@ -435,9 +793,44 @@ class BaseAgent:
         # If we exhausted all retries
         return "Unable to generate report after multiple attempts. Please try again later."
     
+    async def generate_report_async(self, findings: str, prompt: str, system_prompt: str = "") -> str:
+        """Generate an organ report, skipping the API call when the findings are just NP"""
+        if self.normal_report and is_no_pathology(findings):
+            return self.normal_report
+        return await self.generate_response_async(prompt, system_prompt)
+    
     def generate_response(self, prompt: str, system_prompt: str = "") -> str:
         """Synchronous wrapper for generate_response"""
-        return asyncio.run(self.generate_response_async(prompt, system_prompt))
+        return run_sync(self.generate_response_async(prompt, system_prompt))
+
+
+# "Organ: findings" headers the splitter can read without the model, mapped to PatientInfo fields
+SECTION_FIELDS = {
+    'liver': 'liver',
+    'gb': 'gb', 'gallbladder': 'gb', 'gall bladder': 'gb',
+    'pancreas': 'pancreas',
+    'spleen': 'spleen',
+    'kidney': 'kidney', 'kidneys': 'kidney',
+    'aorta': 'aorta',
+    'comment': 'comment', 'comments': 'comment',
+}
+_SECTION_NAMES = "|".join(sorted(map(re.escape, SECTION_FIELDS), key=len, reverse=True))
+SECTION_LINE_PATTERN = re.compile(rf'^\s*({_SECTION_NAMES})\s*:\s*(.*?)\s*$', re.IGNORECASE)
+SECTION_HEADER_PATTERN = re.compile(rf'\b(?:{_SECTION_NAMES})\s*:', re.IGNORECASE)
+# Text fields a batched splitter record must copy from its own INPUT
+SPLIT_TEXT_FIELDS = ("liver", "gb", "pancreas", "spleen", "kidney", "aorta", "comment")
+TEXT_TOKEN_PATTERN = re.compile(r'[^\W\d_]+|\d+')
+
+
+def text_tokens(text: str) -> List[str]:
+    """Casefolded word and number tokens, ignoring punctuation and spacing ("5.3x2.9mm" == "5.3 x 2.9 mm")"""
+    return TEXT_TOKEN_PATTERN.findall(text.casefold())
+
+
+def tokens_in_order(tokens: List[str], source_tokens: List[str]) -> bool:
+    """Whether tokens all appear in source_tokens, in the same order (gaps allowed)"""
+    remaining = iter(source_tokens)
+    return all(token in remaining for token in tokens)
 
 
 class SplitterAgent(BaseAgent):
@@ -500,6 +893,27 @@ class SplitterAgent(BaseAgent):
             "required": ["liver", "gb", "pancreas", "spleen", "kidney", "aorta", "others", "comment"]
         }
         
+        # Batched splits tag each record with its INPUT number so it can be matched back
+        self.batch_item_schema = {
+            **self.response_schema,
+            "properties": {
+                "input": {
+                    "type": "integer",
+                    "description": "Number of the INPUT this record was extracted from"
+                },
+                **self.response_schema["properties"]
+            },
+            "required": ["input", *self.response_schema["required"]]
+        }
+        
+        # Built once - every single-patient split sends the same config
+        self.generation_config = genai.GenerationConfig(
+            temperature=0,
+            max_output_tokens=5000,
+            response_mime_type="application/json",
+            response_schema=self.response_schema
+        )
+        
         self.system_prompt = """You are a medical data extraction specialist. Extract information from radiology patient reports and organize by body part.
 
 Extract information for these categories:
@@ -524,6 +938,12 @@ Preserve all measurements and details exactly as written."""
             print("⚠️  WARNING: Empty patient data received")
             return PatientInfo()
         
+        # Plain "Organ: findings" lines need no model call
+        patient_info = self._fast_split(patient_data)
+        if patient_info is not None:
+            logger.info("✓ Parsed patient data structure without the model")
+            return patient_info
+        
         prompt = f"""Parse this radiology patient information and extract data by body part:
 
 {patient_data}
@@ -532,21 +952,16 @@ Extract the information according to the schema."""
         
         try:
             # Use structured output for guaranteed JSON response
-            response = await asyncio.to_thread(
-                self.model.generate_content,
-                prompt,
-                generation_config=genai.GenerationConfig(
-                    temperature=0,
-                    max_output_tokens=5000,
-                    response_mime_type="application/json",
-                    response_schema=self.response_schema
+            async with request_limiter:
+                response = await self.model.generate_content_async(
+                    prompt,
+                    generation_config=self.generation_config
                 )
-            )
             
             # Parse the guaranteed JSON response
-            data = json.loads(response.text)
+            data = loads_json(response.text)
             
-            print(f"✓ Successfully parsed patient data structure")
+            logger.info("✓ Successfully parsed patient data structure")
             
         except json.JSONDecodeError as e:
             print(f"❌ ERROR: Failed to parse JSON response")
@@ -560,20 +975,15 @@ Extract the information according to the schema."""
             # Handle rate limiting
             if '429' in error_str or 'quota' in error_str or 'rate limit' in error_str:
                 print(f"⚠️  Rate limit hit during patient data splitting. Retrying...")
-                await asyncio.sleep(2)
+                await asyncio.sleep(retry_delay_for(e, self.initial_delay, 1))
                 # Retry once
                 try:
-                    response = await asyncio.to_thread(
-                        self.model.generate_content,
-                        prompt,
-                        generation_config=genai.GenerationConfig(
-                            temperature=0,
-                            max_output_tokens=5000,
-                            response_mime_type="application/json",
-                            response_schema=self.response_schema
+                    async with request_limiter:
+                        response = await self.model.generate_content_async(
+                            prompt,
+                            generation_config=self.generation_config
                         )
-                    )
-                    data = json.loads(response.text)
+                    data = loads_json(response.text)
                 except Exception as retry_error:
                     print(f"❌ ERROR: Retry failed - {retry_error}")
                     return PatientInfo()
@@ -581,7 +991,165 @@ Extract the information according to the schema."""
                 print(f"❌ ERROR: {e}")
                 return PatientInfo()
         
-        # Convert to PatientInfo object
+        return self._to_patient_info(data)
+    
+    async def split_many(self, patient_texts: List[str]) -> List[PatientInfo]:
+        """
+        Split several patients with one structured-output request per chunk of
+        SPLITTER_BATCH_SIZE patients. Chunks run concurrently; a chunk whose
+        response cannot be matched back to its inputs falls back to split().
+        """
+        results: List[Optional[PatientInfo]] = [None] * len(patient_texts)
+        
+        # Empty inputs and plain "Organ: findings" lines never need the model
+        pending = []
+        for i, text in enumerate(patient_texts):
+            if not text or not text.strip():
+                results[i] = await self.split(text)
+                continue
+            results[i] = self._fast_split(text)
+            if results[i] is None:
+                pending.append(i)
+        
+        chunks = [pending[i:i + SPLITTER_BATCH_SIZE] for i in range(0, len(pending), SPLITTER_BATCH_SIZE)]
+        chunk_results = await asyncio.gather(*(
+            self._split_chunk([patient_texts[i] for i in chunk]) for chunk in chunks
+        ))
+        
+        fallbacks = 0
+        for chunk, (infos, fell_back) in zip(chunks, chunk_results):
+            fallbacks += fell_back
+            for i, info in zip(chunk, infos):
+                results[i] = info
+        
+        if fallbacks:
+            logger.warning("⚠️  Batched split: %d of %d chunk(s) fell back to per-patient requests", fallbacks, len(chunks))
+        elif chunks:
+            logger.info("✓ Batched split: all %d chunk(s) parsed in one request each", len(chunks))
+        
+        return results
+    
+    async def _split_chunk(self, patient_texts: List[str]) -> Tuple[List[PatientInfo], bool]:
+        """
+        Split one chunk of patients in a single request.
+        Returns the records and whether the chunk fell back to per-patient split().
+        """
+        if len(patient_texts) == 1:
+            return [await self.split(patient_texts[0])], False
+        
+        inputs = "\n---\n".join(
+            f"INPUT {i}:\n{text}" for i, text in enumerate(patient_texts, 1)
+        )
+        prompt = f"""Parse each radiology patient record below and extract data by body part.
+Return a JSON array with exactly {len(patient_texts)} objects, one per INPUT, in the same order.
+Set "input" in each object to the number of the INPUT it was extracted from.
+
+{inputs}
+
+Extract the information according to the schema."""
+        
+        generation_config = genai.GenerationConfig(
+            temperature=0,
+            max_output_tokens=5000 * len(patient_texts),
+            response_mime_type="application/json",
+            response_schema={"type": "array", "items": self.batch_item_schema}
+        )
+        
+        # The batch carries the splitter prompt ("preserve ... exactly as written")
+        model = get_model(self.system_prompt)
+        
+        # Rate limits and transient errors retry the same batch request - splitting
+        # per patient here would multiply requests just as the quota runs out
+        for attempt in range(self.max_retries):
+            try:
+                async with request_limiter:
+                    response = await model.generate_content_async(
+                        prompt,
+                        generation_config=generation_config
+                    )
+                break
+            except Exception as e:
+                error_str = str(e).lower()
+                if '429' in error_str or 'quota' in error_str or 'rate limit' in error_str or 'resource exhausted' in error_str:
+                    print(f"⚠️  Rate limit hit during batched splitting (attempt {attempt + 1}/{self.max_retries}).")
+                elif 'timeout' in error_str or 'connection' in error_str or 'unavailable' in error_str:
+                    print(f"⚠️  Connection issue during batched splitting (attempt {attempt + 1}/{self.max_retries}).")
+                else:
+                    print(f"⚠️  Batched split failed ({e}). Splitting {len(patient_texts)} patients individually...")
+                    return list(await asyncio.gather(*(self.split(text) for text in patient_texts))), True
+                
+                if attempt == self.max_retries - 1:
+                    print(f"❌ ERROR: Batched split failed after {self.max_retries} attempts - {e}")
+                    return [PatientInfo() for _ in patient_texts], False
+                await asyncio.sleep(retry_delay_for(e, self.initial_delay, attempt))
+        
+        try:
+            records = self._match_records(loads_json(response.text), patient_texts)
+        except Exception as e:
+            print(f"⚠️  Batched split response unusable ({e}). Splitting {len(patient_texts)} patients individually...")
+            return list(await asyncio.gather(*(self.split(text) for text in patient_texts))), True
+        
+        logger.info("✓ Successfully parsed %d patient data structures in one request", len(patient_texts))
+        return [self._to_patient_info(record) for record in records], False
+    
+    @staticmethod
+    def _match_records(data, patient_texts: List[str]) -> List[Dict]:
+        """
+        Order a batched response by INPUT number and check every extracted text
+        comes from that patient's own input (same words and numbers in the same
+        order, punctuation and spacing aside), so a shifted, merged or swapped
+        record never lands in another patient's report. Raises ValueError.
+        """
+        if not isinstance(data, list) or len(data) != len(patient_texts):
+            raise ValueError(f"expected {len(patient_texts)} records, got {len(data) if isinstance(data, list) else 'non-list'}")
+        
+        by_input = {record.get("input"): record for record in data if isinstance(record, dict)}
+        if set(by_input) != set(range(1, len(patient_texts) + 1)):
+            raise ValueError(f"records do not cover INPUT 1-{len(patient_texts)} once each")
+        
+        records = []
+        for i, text in enumerate(patient_texts, 1):
+            record = by_input[i]
+            source = text_tokens(text)
+            extracted = [record.get(field) for field in SPLIT_TEXT_FIELDS]
+            others = record.get("others") or []
+            if not isinstance(others, list):
+                raise ValueError(f"INPUT {i} others is not a list")
+            extracted += [other.get("findings") for other in others if isinstance(other, dict)]
+            for value in extracted:
+                if not isinstance(value, str):
+                    if value is not None:
+                        raise ValueError(f"INPUT {i} has a non-text field")
+                    continue
+                if not tokens_in_order(text_tokens(value), source):
+                    raise ValueError(f"INPUT {i} record has text not found in its input")
+            records.append(record)
+        return records
+    
+    @staticmethod
+    def _fast_split(patient_data: str) -> Optional[PatientInfo]:
+        """
+        Parse text made only of standard "Organ: findings" lines, one per organ.
+        Returns None on anything else (other organs, free text, repeated or
+        run-together headers) so the caller falls back to the model.
+        """
+        fields = {}
+        for line in patient_data.splitlines():
+            if not line.strip():
+                continue
+            match = SECTION_LINE_PATTERN.match(line)
+            if not match:
+                return None
+            field = SECTION_FIELDS[match.group(1).lower()]
+            findings = match.group(2)
+            if field in fields or SECTION_HEADER_PATTERN.search(findings):
+                return None
+            fields[field] = findings
+        return PatientInfo(**fields) if fields else None
+    
+    @staticmethod
+    def _to_patient_info(data: Dict) -> PatientInfo:
+        """Convert a parsed splitter record to a PatientInfo object"""
         return PatientInfo(
             liver=data.get("liver", ""),
             gb=data.get("gb", ""),
@@ -602,6 +1170,7 @@ class LiverAgent(BaseAgent):
     def __init__(self, api_key: str):
         super().__init__(api_key)
         self.organ_name = "Liver"
+        self.normal_report = "The liver is normal in size, outline and echogenicity. No focal dominant intrahepatic mass is seen."
         self.system_prompt = """"You are **the Liver Ultrasound Report Agent**.
 Your job: **generate a short, precise liver ultrasound report (1–4 sentences)** from structured findings. **Output only the report text** — no headings, no metadata, no explanations, and no extra commentary.
 
@@ -664,6 +1233,7 @@ class GBAgent(BaseAgent):
     def __init__(self, api_key: str):
         super().__init__(api_key)
         self.organ_name = "Gallbladder"
+        self.normal_report = "The gallbladder is normal. The intrahepatic and extrahepatic ducts are not dilated."
         self.system_prompt = """ou are the Gallbladder Ultrasound Report Agent.Your job: generate a concise gallbladder & biliary ultrasound report (1–4 sentences) from structured findings. Output only the report text — no headings, no metadata, no explanations, and no extra commentary.
 --- INPUT FORMAT:
 * Global tags (zero or more): Dilated RAS (+), NP, Post Cholecystectomy, Multiple stones, Stones, Polyp(s), Sludge, etc.
@@ -711,6 +1281,7 @@ class PancreasAgent(BaseAgent):
     def __init__(self, api_key: str):
         super().__init__(api_key)
         self.organ_name = "Pancreas"
+        self.normal_report = "The pancreas is normal."
         self.system_prompt = """You are the Pancreas Ultrasound Report Agent.Your job: generate a concise pancreas ultrasound report (1–3 sentences) from structured findings. Output only the report text — no headings, no metadata, no explanations, and no extra commentary.
 --- INPUT FORMAT (the agent will receive these fields):
 * Global tags (zero or more): NP (no pathology), Can't be seen: Tail or Tail not well visualized, Echo Level: Hyper (hyperechoic), etc.
@@ -752,6 +1323,7 @@ class SpleenAgent(BaseAgent):
     def __init__(self, api_key: str):
         super().__init__(api_key)
         self.organ_name = "Spleen"
+        self.normal_report = "The spleen is normal."
         self.system_prompt = """You are the Spleen Ultrasound Report Agent.Your job: generate a concise spleen ultrasound report (1 sentence or 1–2 short sentences) from structured findings. Output only the report text — no headings, no metadata, no explanations, and no extra commentary.
 --- INPUT FORMAT (the agent will receive these fields):
 * Global tags (zero or more): NP (no pathology), Enlarged / Splenomegaly (if present), etc.
@@ -791,6 +1363,7 @@ class KidneyAgent(BaseAgent):
     def __init__(self, api_key: str):
         super().__init__(api_key)
         self.organ_name = "Kidneys"
+        self.normal_report = "The kidneys are normal in size and outline. No pelvicalyceal dilation nor focal contour deforming renal mass is seen."
         self.system_prompt = """You are the Kidney Ultrasound Report Agent.Your job: generate a concise renal ultrasound report (1–4 sentences) for one or both kidneys from structured findings. Output only the report text — no headings, no metadata, no explanations, and no extra commentary.
 --- INPUT FORMAT (the agent will receive these fields):
 * Global tags (zero or more): NP (no pathology), Extra Renal Pelvis, Duplex renal pelvis (or note: previous duplex renal pelvis not detected), laterality tags (Right, Left), etc.
@@ -845,6 +1418,7 @@ class AortaAgent(BaseAgent):
     def __init__(self, api_key: str):
         super().__init__(api_key)
         self.organ_name = "Aorta"
+        self.normal_report = "The abdominal aorta is normal, with no visible calcified plaque."
         self.system_prompt = """You are the Abdominal Aorta Ultrasound Report Agent.Your job: generate a concise abdominal aorta ultrasound report (1–3 short sentences) from structured findings. Output only the report text — no headings, no metadata, no explanations, and no extra commentary.
 --- INPUT FORMAT (the agent will receive these fields):
 * Global tags (zero or more): NP (no pathology), Plaque, Multiple plaques, Calcified plaque, Aneurysm (if present), Location (optional: suprarenal, infrarenal, periaortic), etc.
@@ -978,6 +1552,24 @@ The impression should:
 
 
 
+# Standard organ sections: (log label, PatientInfo field, CentralAgent agent attribute, organ in the prompt)
+STANDARD_ORGANS = (
+    ("Liver", "liver", "liver_agent", "the liver"),
+    ("GB", "gb", "gb_agent", "the gallbladder and CBD"),
+    ("Pancreas", "pancreas", "pancreas_agent", "the pancreas and MPD"),
+    ("Spleen", "spleen", "spleen_agent", "the spleen"),
+    ("Kidney", "kidney", "kidney_agent", "the kidneys"),
+    ("Aorta", "aorta", "aorta_agent", "the aorta"),
+)
+
+# User prompt for a standard organ section - compiled once and filled per patient
+ORGAN_PROMPT_TEMPLATE = Template("""Generate a radiology report section for $organ based on these findings:
+
+$findings
+
+Provide only the report text, no headers or labels.""")
+
+
 class CentralAgent:
     """Central coordinator that manages all specialized agents"""
     
@@ -991,110 +1583,40 @@ class CentralAgent:
         self.aorta_agent = AortaAgent(api_key)
         self.others_agent = OthersAgent(api_key)
         self.impression_agent = ImpressionAgent(api_key)
+        
+        # Standard organ sections bound to their agents, iterated for every patient
+        self.organ_specs = tuple(
+            (label, field, getattr(self, agent_attr), organ)
+            for label, field, agent_attr, organ in STANDARD_ORGANS
+        )
     
-    async def process_patient_async(self, patient_data: str, ultrasound_type: str = "Abdomen") -> str:
-        """Process a single patient's data asynchronously"""
-        # Step 1: Split patient data
-        print("\n[1] Splitting patient data by body part...")
-        patient_info = await self.splitter.split(patient_data)
+    async def process_patient_async(self, patient_data: str, ultrasound_type: str = "Abdomen",
+                                    patient_info: Optional[PatientInfo] = None) -> str:
+        """Process a single patient's data asynchronously (patient_info: already split data, if any)"""
+        # Step 1: Split patient data (skipped when the batch already split it)
+        if patient_info is None:
+            logger.info("\n[1] Splitting patient data by body part...")
+            patient_info = await self.splitter.split(patient_data)
         
         # Step 2: Generate reports for each organ in parallel
-        print("\n[2] Generating individual organ reports...")
+        logger.info("\n[2] Generating individual organ reports...")
         tasks = []
         
-        # Liver
-        if patient_info.liver and patient_info.liver.strip():
-            print("  → Generating Liver report...")
-            prompt = f"""Generate a radiology report section for the liver based on these findings:
-
-{patient_info.liver}
-
-Provide only the report text, no headers or labels."""
-            tasks.append(self.liver_agent.generate_response_async(
-                prompt,
-                self.liver_agent.system_prompt
-            ))
-        
-        # GB
-        if patient_info.gb and patient_info.gb.strip():
-            print("  → Generating GB report...")
-            prompt = f"""Generate a radiology report section for the gallbladder and CBD based on these findings:
-
-{patient_info.gb}
-
-Provide only the report text, no headers or labels."""
-            tasks.append(self.gb_agent.generate_response_async(
-                prompt,
-                self.gb_agent.system_prompt
-            ))
+        # Standard organs, in report order
+        for label, field, agent, organ in self.organ_specs:
+            findings = getattr(patient_info, field)
+            if findings and findings.strip():
+                logger.info("  → Generating %s report...", label)
+                prompt = ORGAN_PROMPT_TEMPLATE.substitute(organ=organ, findings=findings)
+                tasks.append(agent.generate_report_async(findings, prompt, agent.system_prompt))
         
-        # Pancreas
-        if patient_info.pancreas and patient_info.pancreas.strip():
-            print("  → Generating Pancreas report...")
-            prompt = f"""Generate a radiology report section for the pancreas and MPD based on these findings:
-
-{patient_info.pancreas}
-
-Provide only the report text, no headers or labels."""
-            tasks.append(self.pancreas_agent.generate_response_async(
-                prompt,
-                self.pancreas_agent.system_prompt
-            ))
-        
-        # Spleen
-        if patient_info.spleen and patient_info.spleen.strip():
-            print("  → Generating Spleen report...")
-            prompt = f"""Generate a radiology report section for the spleen based on these findings:
-
-{patient_info.spleen}
-
-Provide only the report text, no headers or labels."""
-            tasks.append(self.spleen_agent.generate_response_async(
-                prompt,
-                self.spleen_agent.system_prompt
-            ))
-        
-        # Kidney
-        if patient_info.kidney and patient_info.kidney.strip():
-            print("  → Generating Kidney report...")
-            prompt = f"""Generate a radiology report section for the kidneys based on these findings:
-
-{patient_info.kidney}
-
-Provide only the report text, no headers or labels."""
-            tasks.append(self.kidney_agent.generate_response_async(
-                prompt,
-                self.kidney_agent.system_prompt
-            ))
-
-        # Aorta
-        if patient_info.aorta and patient_info.aorta.strip():
-            print("  → Generating Aorta report...")
-            prompt = f"""Generate a radiology report section for the aorta based on these findings:
-
-{patient_info.aorta}
-
-Provide only the report text, no headers or labels."""
-            tasks.append(self.aorta_agent.generate_response_async(
-                prompt,
-                self.aorta_agent.system_prompt
-            ))
-
-        # Await all organ report tasks
-        print(f"\n  ⚡ Processing {len(tasks)} organs in parallel...")
-        start_time = time.time()
-        organ_reports = await asyncio.gather(*tasks)
-        elapsed = time.time() - start_time
-        print(f"  ✓ All organ reports generated in {elapsed:.2f} seconds.")
-
-        
-        # Others - process each non-standard organ
+        # Others - each non-standard organ joins the same parallel fan-out
         if patient_info.others:
             for other_organ in patient_info.others:
                 organ_name = other_organ.get("organ", "Unknown")
                 findings = other_organ.get("findings", "")
                 if findings and findings.strip():
-                    print(f"  → Generating {organ_name} report...")
+                    logger.info("  → Generating %s report...", organ_name)
                     prompt = f"""Generate a radiology report section for {organ_name} based on these findings:
 
 {findings}
@@ -1103,17 +1625,23 @@ Additional Comments: - Look at the part of the additional comments section that
 
 
 Provide only the report text."""
-                    other_report = await self.others_agent.generate_response_async(
+                    tasks.append(self.others_agent.generate_response_async(
                         prompt,
                         self.others_agent.system_prompt
-                    )
-                    organ_reports.append(other_report)
+                    ))
+
+        # Await all organ report tasks
+        logger.info("\n  ⚡ Processing %d organs in parallel...", len(tasks))
+        start_time = time.perf_counter()
+        organ_reports = await asyncio.gather(*tasks)
+        logger.info("  ✓ All organ reports generated in %.2f seconds.", time.perf_counter() - start_time)
+        
         # Step 3: Combine all sections
-        print("\n[3] Combining report sections...")
+        logger.info("\n[3] Combining report sections...")
         full_report = "\n\n".join(organ_reports)
 
         # Step 4: Generate impression
-        print("\n[4] Generating impression...")
+        logger.info("\n[4] Generating impression...")
         prompt = f"""Based on this complete radiology report, generate a professional IMPRESSION section:
 
 REPORT:
@@ -1129,16 +1657,10 @@ Provide only the impression text, no headers."""
         )
         
         # Step 5: Create final report
-        final_report = f"""ULTRASOUND {ultrasound_type.upper()}
-
-{full_report}
-
-IMPRESSION:
-{impression}
-"""
+        final_report = render_report(ultrasound_type, full_report, impression)
         
-        print("\n✓ Report generation complete!")
-        print("="*80)
+        logger.info("\n✓ Report generation complete!")
+        logger.info(BANNER)
         
         return final_report
 
@@ -1154,58 +1676,75 @@ class RadiologyReportGenerator:
     
     async def process_batch_async(self, patient_data_list: List[Dict], date: str) -> str:
         """Process multiple patients concurrently (FAST!)"""
-        print(f"\n{'='*80}")
+        print(f"\n{BANNER}")
         print(f"PROCESSING BATCH FOR DATE: {date} (ASYNC MODE)")
         print(f"Total patients: {len(patient_data_list)}")
-        print(f"{'='*80}")
+        print(f"{BANNER}")
         
         # Process all patients concurrently
         print(f"\n⚡ Processing {len(patient_data_list)} patients in parallel...")
-        start_time = time.time()
+        start_time = time.perf_counter()
+        
+        # Bound how many patients are in flight at once; gather still returns reports in input order
+        patient_semaphore = asyncio.Semaphore(MAX_CONCURRENT_PATIENTS)
+        
+        async def process_with_limit(examination_finding: str, ultrasound_type: str,
+                                     split_info: Optional[PatientInfo]) -> str:
+            async with patient_semaphore:
+                return await self.central_agent.process_patient_async(examination_finding, ultrasound_type, split_info)
+        
+        # Split every patient up front, several patients per splitter request
+        print(f"\n✂ Splitting {len(patient_data_list)} patient(s), up to {SPLITTER_BATCH_SIZE} per request...")
+        split_infos = await self.central_agent.splitter.split_many(
+            [p.get('examination_finding', '') for p in patient_data_list]
+        )
         
         tasks = []
         names = []
         for i, patient_data in enumerate(patient_data_list, 1):
-            print(f"  • Queuing Patient {i}/{len(patient_data_list)}")
+            logger.info("  • Queuing Patient %d/%d", i, len(patient_data_list))
             examination_finding = patient_data.get('examination_finding', '')
             ultrasound_type = patient_data.get('ultrasound_type', 'Abdomen')
             name = patient_data.get('name')
             names.append(name)
-            tasks.append(self.central_agent.process_patient_async(examination_finding, ultrasound_type))
+            tasks.append(process_with_limit(examination_finding, ultrasound_type, split_infos[i-1]))
         
         # Execute all patients in parallel
         reports = await asyncio.gather(*tasks)
-        elapsed = time.time() - start_time
+        elapsed = time.perf_counter() - start_time
         
         print(f"\n✓ All {len(patient_data_list)} patients processed in {elapsed:.2f} seconds!")
         print(f"  Average: {elapsed/len(patient_data_list):.2f} seconds per patient")
         
-        # Format reports
-        all_reports = []
+        # Format reports straight into one in-memory buffer
+        buffer = io.StringIO()
         for i, report in enumerate(reports, 1):
-            all_reports.append(f"{'='*80}\nPATIENT {names[i-1]}\n{'='*80}\n\n{report}")
-        
-        # Combine all reports
-        combined_report = "\n\n\n".join(all_reports)
+            if i > 1:
+                buffer.write("\n\n\n")
+            buffer.write(format_patient_header(names[i-1]))
+            buffer.write("\n\n")
+            buffer.write(report)
         
         # Save to file
         os.makedirs(self.output_dir, exist_ok=True)
         output_file = os.path.join(self.output_dir, f"radiology_reports_{date}.txt")
         
+        # Single write for the whole batch
         with open(output_file, 'w') as f:
-            f.write(combined_report)
+            f.write(buffer.getvalue())
         
-        print(f"\n\n{'='*80}")
+        print(f"\n\n{BANNER}")
         print(f"✓ BATCH PROCESSING COMPLETE")
         print(f"✓ All reports saved to: {output_file}")
         print(f"✓ Total time: {elapsed:.2f} seconds")
-        print(f"{'='*80}\n")
+        print(f"{BANNER}\n")
         
         return output_file
     
     def process_batch(self, patient_data_list: List[Dict], date: str) -> str:
         """Process multiple patients for a specific date (sync wrapper)"""
-        return asyncio.run(self.process_batch_async(patient_data_list, date))
+        # Same persistent loop for every batch - the SDK's async client is bound to one loop
+        return run_sync(self.process_batch_async(patient_data_list, date))
 
 
 
@@ -1240,9 +1779,9 @@ def main():
         generator = RadiologyReportGenerator(api_key)
         
         # Process the downloaded PDFs
-        print(f"\n{'='*80}")
+        print(f"\n{BANNER}")
         print(f"PROCESSING DOWNLOADED PDFs")
-        print(f"{'='*80}")
+        print(f"{BANNER}")
         
         date_findings = process_date_folders(base_folder_path)
         
@@ -1251,16 +1790,16 @@ def main():
             return
         
         # Process each date separately
-        print(f"\n{'='*80}")
+        print(f"\n{BANNER}")
         print(f"GENERATING REPORTS FOR {len(date_findings)} DATE(S)")
-        print(f"{'='*80}")
+        print(f"{BANNER}")
         
         all_output_files = []
         
         for date, patient_findings in date_findings.items():
-            print(f"\n{'='*80}")
+            print(f"\n{BANNER}")
             print(f"📅 DATE: {date}")
-            print(f"{'='*80}")
+            print(f"{BANNER}")
             
             # Flatten the findings into a list for batch processing
             patient_data_list = []
@@ -1277,9 +1816,9 @@ def main():
                 print(f"  ⚠ No valid patient data to process for {date}")
         
         # Summary
-        print(f"\n\n{'='*80}")
+        print(f"\n\n{BANNER}")
         print(f"✅ REPORT GENERATION COMPLETE")
-        print(f"{'='*80}")
+        print(f"{BANNER}")
         print(f"Generated {len(all_output_files)} report file(s):")
         for output_file in all_output_files:
             print(f"  ✓ {output_file}")